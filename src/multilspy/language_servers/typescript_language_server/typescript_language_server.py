@@ -3,27 +3,105 @@ Provides TypeScript specific instantiation of the LanguageServer class. Contains
 """
 
 import asyncio
+import copy
+import functools
 import json
 import shutil
 import logging
 import os
 import subprocess
 import pathlib
+import threading
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
 from multilspy.multilspy_logger import MultilspyLogger
 from multilspy.language_server import LanguageServer
-from multilspy.lsp_protocol_handler.server import ProcessLaunchInfo
+from multilspy.lsp_protocol_handler.server import NOOP_HANDLER, ProcessLaunchInfo
 from multilspy.lsp_protocol_handler.lsp_types import InitializeParams
 from multilspy.multilspy_config import MultilspyConfig
+from multilspy.multilspy_settings import MultilspySettings
 from multilspy.multilspy_utils import PlatformUtils, PlatformId
-import traceback
 import stat
 
-# Conditionally import pwd module (Unix-only)
-if not PlatformUtils.get_platform_id().value.startswith("win"):
-    import pwd
+try:
+    import orjson as _json
+except ImportError:
+    _json = json
+
+_VALID_PLATFORMS = frozenset({
+    PlatformId.LINUX_x64,
+    PlatformId.LINUX_arm64,
+    PlatformId.OSX,
+    PlatformId.OSX_x64,
+    PlatformId.OSX_arm64,
+    PlatformId.WIN_x64,
+    PlatformId.WIN_arm64,
+})
+
+# Resolved language server launch commands, keyed by (platform_id, tsserver_ls_dir), so that
+# repeated instantiations in the same process skip the dependency checks and install step.
+_TS_SETUP_CACHE: Dict[Tuple[PlatformId, str], str] = {}
+
+# Serializes installation, since concurrent npm installs into the same prefix would race.
+_TS_INSTALL_LOCK = threading.Lock()
+
+
+def _read_json(path: str) -> dict:
+    """
+    Parses the JSON file at the given path, using orjson when it is available.
+    """
+    return _json.loads(pathlib.Path(path).read_bytes())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_tsserver_ls_dir() -> str:
+    """
+    Returns the directory where typescript-language-server is installed. Cached, since computing it creates directories.
+    """
+    return os.path.join(MultilspySettings.get_language_server_directory(), "ts-lsp")
+
+
+@functools.lru_cache(maxsize=1)
+def _load_init_template(path: str) -> dict:
+    """
+    Loads the initialize params template at the given path. The result is shared and must not be mutated.
+    """
+    d = _read_json(path)
+    d.pop("_description", None)
+    return d
+
+
+@functools.lru_cache(maxsize=None)
+def _which(name: str) -> Optional[str]:
+    """
+    Returns the path of the given executable on PATH, or None if it is not found. Cached for the process lifetime.
+    """
+    return shutil.which(name)
+
+
+def _batch_install_commands(runtime_dependencies: List[dict]) -> List[List[str]]:
+    """
+    Returns the install commands for the given runtime dependencies. When all of them are `npm install`
+    commands with identical options that differ only in the package spec, they are merged into a single
+    invocation, so that node/npm start up only once.
+    """
+    commands = [dependency["argv"] for dependency in runtime_dependencies]
+    if len(commands) > 1 and all(
+        cmd[:2] == ["npm", "install"] and cmd[:-1] == commands[0][:-1] for cmd in commands
+    ):
+        return [commands[0][:-1] + [cmd[-1] for cmd in commands]]
+    return commands
+
+
+def _stat_or_none(path: str) -> Optional[os.stat_result]:
+    """
+    Returns the stat result for the given path, or None if it cannot be stat-ed.
+    """
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
 
 
 class TypeScriptLanguageServer(LanguageServer):
@@ -47,152 +125,177 @@ class TypeScriptLanguageServer(LanguageServer):
 
     def setup_runtime_dependencies(self, logger: MultilspyLogger, config: MultilspyConfig) -> str:
         """
-        Setup runtime dependencies for TypeScript Language Server with detailed debugging using print statements.
+        Detects the runtime dependencies for TypeScript Language Server and returns the command to launch it.
+
+        This only performs cheap checks. If typescript-language-server is not installed yet, the installation
+        is deferred to start_server (see _install_runtime_dependencies).
         """
         try:
-            print("[INFO] Starting setup_runtime_dependencies")
+            logger.log("Starting setup_runtime_dependencies", logging.DEBUG)
             platform_id = PlatformUtils.get_platform_id()
-            print(f"[INFO] Detected platform: {platform_id}")
-
-            valid_platforms = [
-                PlatformId.LINUX_x64,
-                PlatformId.LINUX_arm64,
-                PlatformId.OSX,
-                PlatformId.OSX_x64,
-                PlatformId.OSX_arm64,
-                PlatformId.WIN_x64,
-                PlatformId.WIN_arm64,
-            ]
-            if platform_id not in valid_platforms:
+            logger.log(f"Detected platform: {platform_id}", logging.DEBUG)
+
+            if platform_id not in _VALID_PLATFORMS:
                 msg = f"Platform {platform_id} is not supported for multilspy javascript/typescript at the moment"
-                print(f"[ERROR] {msg}")
+                logger.log(msg, logging.ERROR)
                 raise AssertionError(msg)
 
         except Exception as e:
-            print(f"[ERROR] Error validating platform: {e}\n{traceback.format_exc()}")
-            raise
-
-        # Load runtime dependencies
-        try:
-            runtime_json_path = os.path.join(os.path.dirname(__file__), "runtime_dependencies.json")
-            print(f"[INFO] Loading runtime dependencies from {runtime_json_path}")
-            with open(runtime_json_path, "r") as f:
-                d = json.load(f)
-                print("[INFO] Loaded JSON successfully")
-                d.pop("_description", None)
-                runtime_dependencies = d.get("runtimeDependencies", [])
-                print(f"[INFO] Found {len(runtime_dependencies)} runtime dependencies")
-        except Exception as e:
-            print(f"[ERROR] Error loading runtime_dependencies.json: {e}\n{traceback.format_exc()}")
+            logger.log(f"Error validating platform: {e}", logging.ERROR)
             raise
 
         # Compute paths
-        try:
-            original_path = os.path.dirname(__file__)
-            print(f"[INFO] Original path: {original_path}")
-            src_index = original_path.find('site-packages/')
-            if src_index == -1:
-                msg = "'site-packages/' not found in path"
-                print(f"[ERROR] {msg}")
-                raise ValueError(msg)
-            relative_path = original_path[src_index:]
-            new_path = os.path.join('/tmp', "")
-            tsserver_ls_dir = os.path.join(new_path, "static", "ts-lsp")
-            print(f"[INFO] Target ts-lsp directory: {tsserver_ls_dir}")
-        except Exception as e:
-            print(f"[ERROR] Error computing paths: {e}\n{traceback.format_exc()}")
-            raise
+        tsserver_ls_dir = _get_tsserver_ls_dir()
+        logger.log(f"Target ts-lsp directory: {tsserver_ls_dir}", logging.DEBUG)
+
+        self._setup_cache_key = (platform_id, tsserver_ls_dir)
+        self._pending_install = False
+        if self._setup_cache_key in _TS_SETUP_CACHE:
+            logger.log("Using cached typescript-language-server setup", logging.DEBUG)
+            return _TS_SETUP_CACHE[self._setup_cache_key]
 
         # Verify Node and npm
         try:
-            print("[INFO] Checking for node installation")
-            assert shutil.which('node'), "node is not installed or isn't in PATH"
-            print("[INFO] Node found")
-            print("[INFO] Checking for npm installation")
-            assert shutil.which('npm'), "npm is not installed or isn't in PATH"
-            print("[INFO] npm found")
+            logger.log("Checking for node installation", logging.DEBUG)
+            assert _which('node'), "node is not installed or isn't in PATH"
+            logger.log("Node found", logging.DEBUG)
+            logger.log("Checking for npm installation", logging.DEBUG)
+            assert _which('npm'), "npm is not installed or isn't in PATH"
+            logger.log("npm found", logging.DEBUG)
         except AssertionError as e:
-            print(f"[ERROR] Dependency check failed: {e}")
+            logger.log(f"Dependency check failed: {e}", logging.ERROR)
             raise
         except Exception as e:
-            print(f"[ERROR] Unexpected error checking dependencies: {e}\n{traceback.format_exc()}")
+            logger.log(f"Unexpected error checking dependencies: {e}", logging.ERROR)
+            raise
+
+        tsserver_executable = os.path.join(tsserver_ls_dir, "node_modules", ".bin", "typescript-language-server")
+        self._pending_install = _stat_or_none(tsserver_executable) is None
+        if self._pending_install:
+            logger.log(f"typescript-language-server not found at {tsserver_executable}, deferring installation", logging.DEBUG)
+        else:
+            _TS_SETUP_CACHE[self._setup_cache_key] = f"{tsserver_executable} --stdio"
+        return f"{tsserver_executable} --stdio"
+
+    def _install_runtime_dependencies(self) -> None:
+        """
+        Installs the runtime dependencies for TypeScript Language Server, unless another instance already has. This is a blocking call.
+        """
+        with _TS_INSTALL_LOCK:
+            if self._setup_cache_key in _TS_SETUP_CACHE:
+                self.logger.log("typescript-language-server already installed by another instance", logging.DEBUG)
+                self._pending_install = False
+                return
+            self._install_runtime_dependencies_locked()
+
+    def _install_runtime_dependencies_locked(self) -> None:
+        """
+        Installs the runtime dependencies for TypeScript Language Server. Must be called with _TS_INSTALL_LOCK held.
+        """
+        platform_id, tsserver_ls_dir = self._setup_cache_key
+        tsserver_executable = os.path.join(tsserver_ls_dir, "node_modules", ".bin", "typescript-language-server")
+
+        # Load runtime dependencies
+        try:
+            runtime_json_path = os.path.join(os.path.dirname(__file__), "runtime_dependencies.json")
+            self.logger.log(f"Loading runtime dependencies from {runtime_json_path}", logging.DEBUG)
+            d = _read_json(runtime_json_path)
+            self.logger.log("Loaded JSON successfully", logging.DEBUG)
+            d.pop("_description", None)
+            runtime_dependencies = d.get("runtimeDependencies", [])
+            self.logger.log(f"Found {len(runtime_dependencies)} runtime dependencies", logging.DEBUG)
+        except Exception as e:
+            self.logger.log(f"Error loading runtime_dependencies.json: {e}", logging.ERROR)
             raise
 
         # Install dependencies if needed
         try:
-            if not os.path.exists(tsserver_ls_dir):
-                print(f"[INFO] Creating directory {tsserver_ls_dir}")
-                os.makedirs(tsserver_ls_dir, exist_ok=True, mode=0o777)
-                os.chmod(tsserver_ls_dir, 0o777)
-                for dependency in runtime_dependencies:
-                    cmd = dependency.get("command")
-                    print(f"[INFO] Running install command: {cmd} in {tsserver_ls_dir}")
+            if _stat_or_none(tsserver_executable) is None:
+                self.logger.log(f"Creating directory {tsserver_ls_dir}", logging.DEBUG)
+                os.makedirs(tsserver_ls_dir, exist_ok=True)
+                if not platform_id.startswith("win") and self.logger.is_enabled_for(logging.DEBUG):
+                    import pwd  # Unix-only
+
+                    user = pwd.getpwuid(os.getuid()).pw_name
+                    self.logger.log(f"Running as user: {user} (UID={os.getuid()}, GID={os.getgid()})", logging.DEBUG)
+                    # log directory permissions and ownership for debugging
+                    stat_info = os.stat(tsserver_ls_dir)
+                    mode_octal = oct(stat.S_IMODE(stat_info.st_mode))
+                    mode_str = stat.filemode(stat_info.st_mode)
+                    self.logger.log(
+                        f"{tsserver_ls_dir} owner={stat_info.st_uid}:{stat_info.st_gid} perms={mode_octal} ({mode_str})",
+                        logging.DEBUG,
+                    )
+                for cmd in _batch_install_commands(runtime_dependencies):
+                    self.logger.log(f"Running install command: {' '.join(cmd)} in {tsserver_ls_dir}", logging.DEBUG)
                     try:
-                        platform_id = PlatformUtils.get_platform_id()
-                        if platform_id.startswith("win"):
-                            subprocess.run(cmd, shell=True, check=True, cwd=tsserver_ls_dir,
-                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                        else:
-                            user = pwd.getpwuid(os.getuid()).pw_name
-                            print(f"[DEBUG] Running as user: {user} (UID={os.getuid()}, GID={os.getgid()})")
-                            # print out directory permissions and ownership for debugging
-                            stat_info = os.stat(tsserver_ls_dir)
-                            print(f"[DEBUG] {tsserver_ls_dir} perms={oct(stat_info.st_mode)} owner={stat_info.st_uid}:{stat_info.st_gid}")
-                            # print out directory permissions and ownership for debugging
-                            stat_info = os.stat(tsserver_ls_dir)
-                            mode_octal = oct(stat.S_IMODE(stat_info.st_mode))
-                            mode_str  = stat.filemode(stat_info.st_mode)
-                            print(f"[DEBUG] {tsserver_ls_dir} owner={stat_info.st_uid}:{stat_info.st_gid}")
-                            print(f"[DEBUG] {tsserver_ls_dir} perms (octal)={mode_octal}")
-                            print(f"[DEBUG] {tsserver_ls_dir} perms (string)={mode_str}")
-                            subprocess.run(cmd, shell=True, check=True, cwd=tsserver_ls_dir,
-                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                            print(f"[INFO] Successfully installed dependency with command: {cmd}")
+                        # Resolve the executable explicitly so that npm.cmd is found on Windows without a shell
+                        subprocess.run([_which(cmd[0]) or cmd[0], *cmd[1:]], check=True, cwd=tsserver_ls_dir,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                        self.logger.log(f"Successfully installed dependency with command: {cmd}", logging.DEBUG)
                     except subprocess.CalledProcessError as cmd_e:
-                        print(f"[ERROR] Command failed: {cmd} with error: {cmd_e}\n{traceback.format_exc()}")
+                        self.logger.log(f"Command failed: {cmd} with error: {cmd_e}", logging.ERROR)
                         raise
         except Exception as e:
-            print(f"[ERROR] Error installing runtime dependencies: {e}\n{traceback.format_exc()}")
+            self.logger.log(f"Error installing runtime dependencies: {e}", logging.ERROR)
             raise
 
         # Verify final executable
         try:
-            tsserver_executable = os.path.join(tsserver_ls_dir, "node_modules", ".bin", "typescript-language-server")
-            print(f"[INFO] Verifying executable at {tsserver_executable}")
-            if not os.path.exists(tsserver_executable):
+            self.logger.log(f"Verifying executable at {tsserver_executable}", logging.DEBUG)
+            if _stat_or_none(tsserver_executable) is None:
                 msg = "typescript-language-server executable not found. Please install typescript-language-server and try again."
-                print(f"[ERROR] {msg}")
+                self.logger.log(msg, logging.ERROR)
                 raise FileNotFoundError(msg)
-            print("[INFO] typescript-language-server found")
-            return f"{tsserver_executable} --stdio"
+            self.logger.log("typescript-language-server found", logging.DEBUG)
+            _TS_SETUP_CACHE[self._setup_cache_key] = f"{tsserver_executable} --stdio"
+            self._pending_install = False
         except Exception as e:
-            print(f"[ERROR] Error verifying tsserver executable: {e}\n{traceback.format_exc()}")
+            self.logger.log(f"Error verifying tsserver executable: {e}", logging.ERROR)
             raise
 
     def _get_initialize_params(self, repository_absolute_path: str) -> InitializeParams:
         """
         Returns the initialize params for the TypeScript Language Server.
         """
-        with open(os.path.join(os.path.dirname(__file__), "initialize_params.json"), "r") as f:
-            d = json.load(f)
+        d = copy.deepcopy(_load_init_template(os.path.join(os.path.dirname(__file__), "initialize_params.json")))
 
-        del d["_description"]
+        repository_uri = pathlib.Path(repository_absolute_path).as_uri()
 
         d["processId"] = os.getpid()
         assert d["rootPath"] == "$rootPath"
         d["rootPath"] = repository_absolute_path
 
         assert d["rootUri"] == "$rootUri"
-        d["rootUri"] = pathlib.Path(repository_absolute_path).as_uri()
+        d["rootUri"] = repository_uri
 
         assert d["workspaceFolders"][0]["uri"] == "$uri"
-        d["workspaceFolders"][0]["uri"] = pathlib.Path(repository_absolute_path).as_uri()
+        d["workspaceFolders"][0]["uri"] = repository_uri
 
         assert d["workspaceFolders"][0]["name"] == "$name"
         d["workspaceFolders"][0]["name"] = os.path.basename(repository_absolute_path)
 
         return d
     
+    async def _register_capability_handler(self, params):
+        """Handles client/registerCapability requests from the server."""
+        assert "registrations" in params
+        for registration in params["registrations"]:
+            if registration["method"] == "workspace/executeCommand":
+                self.initialize_searcher_command_available.set()
+                # TypeScript doesn't have a direct equivalent to resolve_main_method
+                # You might want to set a different flag or remove this line
+                # self.resolve_main_method_available.set()
+        return
+
+    async def _execute_client_command_handler(self, params):
+        """Handles workspace/executeClientCommand requests from the server."""
+        return []
+
+    async def _window_log_message(self, msg):
+        """Logs window/logMessage notifications from the server."""
+        self.logger.log(f"LSP: window/logMessage: {msg}", logging.INFO)
+
     @asynccontextmanager
     async def start_server(self) -> AsyncIterator["TypeScriptLanguageServer"]:
         """
@@ -208,32 +311,17 @@ class TypeScriptLanguageServer(LanguageServer):
         # LanguageServer has been shutdown
         """
 
-        async def register_capability_handler(params):
-            assert "registrations" in params
-            for registration in params["registrations"]:
-                if registration["method"] == "workspace/executeCommand":
-                    self.initialize_searcher_command_available.set()
-                    # TypeScript doesn't have a direct equivalent to resolve_main_method
-                    # You might want to set a different flag or remove this line
-                    # self.resolve_main_method_available.set()
-            return
-
-        async def execute_client_command_handler(params):
-            return []
-
-        async def do_nothing(params):
-            return
-
-        async def window_log_message(msg):
-            self.logger.log(f"LSP: window/logMessage: {msg}", logging.INFO)
-
-        self.server.on_request("client/registerCapability", register_capability_handler)
-        self.server.on_notification("window/logMessage", window_log_message)
-        self.server.on_request("workspace/executeClientCommand", execute_client_command_handler)
-        self.server.on_notification("$/progress", do_nothing)
-        self.server.on_notification("textDocument/publishDiagnostics", do_nothing)
+        self.server.on_request("client/registerCapability", self._register_capability_handler)
+        self.server.on_notification("window/logMessage", self._window_log_message)
+        self.server.on_request("workspace/executeClientCommand", self._execute_client_command_handler)
+        self.server.on_notification("$/progress", NOOP_HANDLER)
+        self.server.on_notification("textDocument/publishDiagnostics", NOOP_HANDLER)
 
         async with super().start_server():
+            if self._pending_install:
+                self.logger.log("Installing TypeScript runtime dependencies", logging.INFO)
+                await asyncio.get_running_loop().run_in_executor(None, self._install_runtime_dependencies)
+
             self.logger.log("Starting TypeScript server process", logging.INFO)
             await self.server.start()
             initialize_params = self._get_initialize_params(self.repository_root_path)
@@ -247,17 +335,12 @@ class TypeScriptLanguageServer(LanguageServer):
             # TypeScript-specific capability checks
             assert init_response["capabilities"]["textDocumentSync"] == 2
             assert "completionProvider" in init_response["capabilities"]
-            assert init_response["capabilities"]["completionProvider"] == {
-                "triggerCharacters": ['.', '"', "'", '/', '@', '<'],
-                "resolveProvider": True
-            }
             
             self.server.notify.initialized({})
             self.completions_available.set()
 
             # TypeScript server is typically ready immediately after initialization
             self.server_ready.set()
-            await self.server_ready.wait()
 
             yield self
 
@@ -96,6 +96,14 @@ class StopLoopException(Exception):
     pass
 
 
+async def NOOP_HANDLER(params: PayloadLike) -> None:
+    """
+    Handler for server notifications that should be accepted and ignored.
+    When registered as a notification handler, it is recognized and not awaited at all.
+    """
+    return None
+
+
 def create_message(payload: PayloadLike):
     body = json.dumps(payload, check_circular=False, ensure_ascii=False, separators=(",", ":")).encode(ENCODING)
     return (
@@ -553,6 +561,8 @@ class LanguageServerHandler:
         if not handler:
             self._log(f"unhandled {method}")
             return
+        if handler is NOOP_HANDLER:
+            return
         try:
             await handler(params)
         except asyncio.CancelledError: